@@ -0,0 +1,302 @@
+# backfill.py
+# Offline bulk scan of a channel-history export (one JSON message per line) through
+# TinyLlama + Critic, so guilds the bot joins late still get their history checked.
+#
+#   python backfill.py history.jsonl --output flagged.jsonl --workers 4
+#
+# Progress is checkpointed every --checkpoint-interval seconds; re-running the same command
+# after a crash resumes from the last checkpoint instead of starting over. Each checkpoint
+# writes the whole dedupe filter (120 MB at the defaults), so it is timed rather than
+# counted in batches, keeping its share of the run small however fast scoring is.
+import argparse
+import collections
+import hashlib
+import json
+import math
+import multiprocessing as mp
+import os
+import re
+import time
+import unicodedata
+import numpy as np
+
+# zero-width and BOM characters are commonly used to dodge keyword filters
+_INVISIBLE = re.compile("[\u200b\u200c\u200d\u2060\ufeff]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalise(text):
+    """NFKC-fold, drop invisible characters and collapse whitespace."""
+    text = unicodedata.normalize("NFKC", text)
+    text = _INVISIBLE.sub("", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class SeenFilter:
+    """
+    Fixed-size Bloom filter of message fingerprints, so dedupe memory stays constant no
+    matter how long the export is. Every false positive silently drops a unique message
+    as a "duplicate", so the filter is sized for `expected` unique messages at a target
+    false-positive rate `fp_rate`:
+
+        bits = -expected * ln(fp_rate) / ln(2)^2,   hashes = bits / expected * ln(2)
+
+    e.g. 50M messages at 1e-4 is 958 Mbit (120 MB) and 13 hashes. Past `expected` the
+    rate climbs quickly, so size it for the whole export.
+    """
+
+    def __init__(self, expected=50_000_000, fp_rate=1e-4, bits=None, hashes=None):
+        if bits is None:
+            bits = int(math.ceil(-expected * math.log(fp_rate) / math.log(2) ** 2))
+            bits = (bits + 7) // 8 * 8
+        if hashes is None:
+            hashes = max(1, round(bits / expected * math.log(2)))
+        self.bits = bits
+        self.hashes = hashes
+        self.array = np.zeros(bits // 8, dtype=np.uint8)
+
+    def _positions(self, text):
+        # double hashing: position_i = h1 + i * h2 behaves like independent hashes for a Bloom filter
+        digest = hashlib.blake2b(text.casefold().encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, text):
+        """Record text; returns True if it (probably) has been seen before."""
+        seen = True
+        for pos in self._positions(text):
+            byte, bit = divmod(pos, 8)
+            if not self.array[byte] & (1 << bit):
+                seen = False
+                self.array[byte] |= 1 << bit
+        return seen
+
+
+# ---------------------------------------------------------------- worker processes
+
+_worker = None
+
+
+def _init_worker(threads):
+    # each worker process loads its own copy of TinyLlama + critic once
+    global _worker
+    import torch
+    from scorer import load_scorer
+    torch.set_num_threads(threads)
+    _worker = load_scorer()
+
+
+def _score(texts):
+    from scorer import score_batch
+    probs, _ = score_batch(texts, *_worker)
+    return probs
+
+
+# ---------------------------------------------------------------- checkpointing
+
+def _load_checkpoint(path):
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r") as f:
+        state = json.load(f)
+    state["seen"] = np.load(state["seen_file"])
+    return state
+
+
+def _save_checkpoint(path, state, seen):
+    """
+    Each checkpoint writes its dedupe filter under its own name, referenced from the JSON.
+    Renaming the JSON into place is the single commit point: a crash before it leaves the
+    previous JSON still pointing at the previous filter, so offset and filter always agree.
+    """
+    state["seen_file"] = f"{path}.seen.{state['seq']}.npy"
+    state["bloom_bits"], state["bloom_hashes"] = seen.bits, seen.hashes
+    with open(state["seen_file"], "wb") as f:
+        np.save(f, seen.array)
+        f.flush()
+        os.fsync(f.fileno())
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+    previous = f"{path}.seen.{state['seq'] - 1}.npy"
+    if os.path.isfile(previous):
+        os.remove(previous)
+
+
+# ---------------------------------------------------------------- scan
+
+def _batches(f, batch_size, seen, counters):
+    """
+    Yield (messages, end_offset) batches of unique, non-empty messages read from f.
+    end_offset is the byte offset just past the last line consumed for the batch.
+    """
+    batch = []
+    while True:
+        line = f.readline()
+        if not line:
+            break
+        counters["read"] += 1
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        # valid JSON that is not a message object (e.g. a bare string or null) is malformed too
+        content = (record.get("content") or record.get("text") or "") if isinstance(record, dict) else None
+        if not isinstance(content, str):
+            counters["malformed"] += 1
+            continue
+        text = normalise(content)
+        if not text:
+            continue
+        if seen.add(text):
+            counters["duplicates"] += 1
+            continue
+        batch.append({
+            "id": record.get("id"),
+            "channel_id": record.get("channel_id"),
+            "author": record.get("author"),
+            "content": text,
+        })
+        if len(batch) == batch_size:
+            yield batch, f.tell()
+            batch = []
+    if batch:
+        yield batch, f.tell()
+
+
+def scan(input_path, output_path, checkpoint_path, threshold=0.5, batch_size=32,
+         workers=1, checkpoint_interval=300.0, log_every=10.0, expected_messages=50_000_000,
+         dedupe_fp_rate=1e-4):
+    counters = collections.Counter()
+    offset = 0
+    out_size = 0
+    seq = 0
+
+    state = _load_checkpoint(checkpoint_path)
+    if state is not None:
+        if state["input"] != os.path.abspath(input_path):
+            raise Exception(f"{checkpoint_path} belongs to a scan of {state['input']}; delete it to start over.")
+        offset, out_size, seq = state["offset"], state["output_size"], state["seq"]
+        counters.update(state["counters"])
+        # keep the filter's original size so its bits still mean the same messages
+        seen = SeenFilter(bits=state["bloom_bits"], hashes=state["bloom_hashes"])
+        seen.array[:] = state["seen"]
+        print(f"Resuming from byte {offset} ({counters['read']} messages already read)")
+    else:
+        seen = SeenFilter(expected_messages, dedupe_fp_rate)
+
+    # drop anything written after the last checkpoint; it will be rescored
+    with open(output_path, "ab") as out:
+        out.truncate(out_size)
+
+    if workers > 0:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        pool = mp.get_context("spawn").Pool(workers, initializer=_init_worker, initargs=(threads,))
+        submit = lambda texts: pool.apply_async(_score, (texts,))
+    else:
+        pool = None
+        _init_worker(os.cpu_count() or 1)
+        submit = lambda texts: _Done(_score(texts))
+
+    started = time.time()
+    scored_at_start = counters["scored"]
+    last_log = started
+    last_checkpoint = started
+    # bounded number of in-flight batches keeps memory constant however far ahead the reader could get
+    pending = collections.deque()
+    max_pending = 2 * max(workers, 1)
+
+    def finish_oldest(out):
+        batch, result = pending.popleft()
+        for msg, prob in zip(batch, result.get()):
+            counters["scored"] += 1
+            if prob >= threshold:
+                counters["flagged"] += 1
+                msg["score"] = round(prob, 4)
+                out.write(json.dumps(msg, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    try:
+        with open(input_path, "rb") as f, open(output_path, "a", encoding="utf-8") as out:
+            f.seek(offset)
+            for batch, end_offset in _batches(f, batch_size, seen, counters):
+                pending.append((batch, submit([m["content"] for m in batch])))
+                if len(pending) >= max_pending:
+                    finish_oldest(out)
+
+                if time.time() - last_checkpoint >= checkpoint_interval:
+                    # drain so the checkpoint's offset, dedupe filter and output all agree
+                    while pending:
+                        finish_oldest(out)
+                    out.flush()
+                    seq += 1
+                    _save_checkpoint(checkpoint_path, {
+                        "input": os.path.abspath(input_path),
+                        "offset": end_offset,
+                        "output_size": out.tell(),
+                        "counters": dict(counters),
+                        "seq": seq,
+                    }, seen)
+                    last_checkpoint = time.time()
+
+                now = time.time()
+                if now - last_log >= log_every:
+                    rate = (counters["scored"] - scored_at_start) / (now - started)
+                    print(f"read {counters['read']}, scored {counters['scored']}, "
+                          f"flagged {counters['flagged']}, {rate:.1f} messages/sec")
+                    last_log = now
+
+            while pending:
+                finish_oldest(out)
+            out.flush()
+            seq += 1
+            _save_checkpoint(checkpoint_path, {
+                "input": os.path.abspath(input_path),
+                "offset": f.tell(),
+                "output_size": out.tell(),
+                "counters": dict(counters),
+                "seq": seq,
+            }, seen)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    elapsed = time.time() - started
+    rate = (counters["scored"] - scored_at_start) / max(elapsed, 1e-9)
+    print(f"Done: read {counters['read']} messages, {counters['duplicates']} duplicates, "
+          f"{counters['malformed']} malformed, scored {counters['scored']}, flagged {counters['flagged']}. "
+          f"{rate:.1f} messages/sec this run.")
+    return counters
+
+
+class _Done:
+    """Already-computed result with the same get() interface as an AsyncResult."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scan a channel history export for sextortion.")
+    parser.add_argument("input", help="JSONL export, one message per line with a 'content' field")
+    parser.add_argument("--output", default="backfill_flagged.jsonl")
+    parser.add_argument("--checkpoint", default=None, help="defaults to <output>.ckpt")
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=1, help="0 scores in this process (e.g. on one GPU)")
+    parser.add_argument("--checkpoint-interval", type=float, default=300.0, help="seconds between checkpoints")
+    parser.add_argument("--expected-messages", type=int, default=50_000_000,
+                        help="unique messages the dedupe filter is sized for")
+    parser.add_argument("--dedupe-fp-rate", type=float, default=1e-4,
+                        help="target rate of unique messages wrongly dropped as duplicates")
+    args = parser.parse_args()
+
+    scan(args.input, args.output, args.checkpoint or args.output + ".ckpt",
+         threshold=args.threshold, batch_size=args.batch_size, workers=args.workers,
+         checkpoint_interval=args.checkpoint_interval, expected_messages=args.expected_messages,
+         dedupe_fp_rate=args.dedupe_fp_rate)
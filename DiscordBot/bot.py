@@ -1,96 +1,81 @@
 # bot.py
 import discord
+import asyncio
 from discord.ext import commands
 import os
 import json
 import logging
 import re
+import time
 import requests
 from report import Report, State
+from similar_reports import ReportIndex, format_similar
+from scheduler import Priority, ScoringScheduler
+from routing import ChannelRouter
+from student import STUDENT_PATH, load_student, predict_student
+from risk import RiskTable
+from online_critic import (ONLINE_CRITIC_PATH, LabelLog, finetune, load_trained_on, report_category,
+                           save_trained_on, validation_features)
 import pdb
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
-import torch.nn as nn
 import pandas as pd
+from scorer import CRITIC_PATH, load_scorer, score_batch
 
 knownViolators = {} # global! keeps track over all messages
+NEW_ACCOUNT_DAYS = 7 # accounts younger than this get their messages scored ahead of the rest
+SCORING_STATS_KEYWORD = "scoring stats" # say this in the mod channel to see scoring queue counters
+FALLBACK_HIT_THRESHOLD = 0.5 # keyword fallback scores at or above this are shown to mods and re-scored later
+MAX_DEFERRED_RESCORES = 5000 # cap on fallback hits waiting for a model re-score
+RESCORE_RETRY_SECONDS = 5.0 # how often deferred re-scores check whether the scoring queue has recovered
+USE_STUDENT = False # score channel messages with the distilled student (see distill.py) instead of TinyLlama
+TEACHER_RECHECK_MARGIN = 0.1 # student scores above 0.5 minus this are re-scored by TinyLlama; None trusts the student
+RISK_HALF_LIFE = 3600.0 # seconds for a message's contribution to rolling risk to halve
+SUSTAINED_RISK_THRESHOLD = 1.2 # rolling risk that triggers an automatic report (e.g. 5-6 messages scoring 0.45 within a few minutes)
+CRITIC_UPDATE_INTERVAL = 6 * 3600 # seconds between checks for new moderator labels to fine-tune the critic on
+CRITIC_UPDATE_MIN_LABELS = 50 # new moderator labels needed before a fine-tuning run
 
 # code for importing and running automatic bot
-class Critic(nn.Module):
-    def __init__(self, hidden_size):
-        super().__init__()
-        self.critic = nn.Sequential(
-            nn.Linear(hidden_size, 2048),
-            nn.ReLU(),
-            nn.Linear(2048, 2048),
-            nn.ReLU(),
-            nn.Linear(2048, 1)
-        )
-
-    def forward(self, hidden_vec):
-        return self.critic(hidden_vec)   # returns shape [batch_size, 1]
-
-
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
-
-base_model_name = "TinyLlama/TinyLlama-1.1B-Chat-v1.0"
-model = AutoModelForCausalLM.from_pretrained(
-    base_model_name,
-    output_hidden_states=True
-).to(device)
-model.eval()
-
-tokenizer = AutoTokenizer.from_pretrained(
-    base_model_name,
-    padding_side="left"
-)
-
-# create new critic and load trained values into it
+# prefer weights fine-tuned online from moderator verdicts, if a previous run produced them
+critic_load_path = ONLINE_CRITIC_PATH if os.path.isfile(ONLINE_CRITIC_PATH) else CRITIC_PATH
+model, tokenizer, critic, device = load_scorer(critic_path=critic_load_path)
 hidden_size = model.config.hidden_size 
 print("hidden size of tiny llama:", hidden_size)
-critic = Critic(hidden_size).to(device)
-critic_load_path = "critic_sextortion.pt"
-critic.load_state_dict(torch.load(critic_load_path, map_location=device))
-critic.eval()
 print(f"Loaded critic weights from {critic_load_path}")
 
+student = None
+if USE_STUDENT:
+    student = load_student(STUDENT_PATH)
+    print(f"Loaded student weights from {STUDENT_PATH}")
+
+def finetune_live_critic(label_log):
+    '''
+    Fine-tune a copy of the live critic on the moderator label log and validate it on the
+    test split. Blocking; the bot runs it in a worker thread. Returns (new critic or None, metrics).
+    '''
+    val_hidden, val_labels = validation_features(model, tokenizer, critic, device)
+    return finetune(critic, label_log, val_hidden, val_labels, device)
+
+def swap_critic(new_critic):
+    # rebinding the global is atomic, so an in-flight prediction finishes on the old weights
+    global critic
+    critic = new_critic
+
 # use critic to predict if message is from perpetrator of sextortion
 def predict_sextortion(text: str) -> float:
     """
     Returns a float in [0,1], the critic’s predicted probability
     that ‘text’ is a sextortion message.
     """
-    # tokenize message
-    toks = tokenizer(
-        text,
-        return_tensors="pt",
-        padding=True,
-        truncation=True
-    )
-    
-    input_ids      = toks["input_ids"].to(device)      # [1, seq_len]
-    attention_mask = toks["attention_mask"].to(device)
-
-    # forward pass through TinyLlama (to get hidden states)
-    with torch.no_grad():
-        outputs = model(
-            input_ids=input_ids,
-            attention_mask=attention_mask,
-            output_hidden_states=True,
-            return_dict=True
-        )
-        # take the last hidden state for the last token (bc tinyllama is causal, reps all previous tokens)
-        last_token_hidden = outputs.hidden_states[-1][:, -1, :]       # [1, seq_len, hidden_size]
-        
-
-        # forward pass through critic → raw score
-        score = critic(last_token_hidden).view(-1)                # [1]
-
-        # convert to prob via sigmoid
-        prob = torch.sigmoid(score).item()             # Python float in [0,1]
-        
-        return prob
+    prob, _ = predict_sextortion_with_hidden(text)
+    return prob
+
+def predict_sextortion_with_hidden(text: str):
+    """
+    Same as predict_sextortion, but also returns the last-token hidden state the critic
+    scored, as a float32 numpy vector of size hidden_size (used by the similar-reports index).
+    """
+    probs, hidden = score_batch([text], model, tokenizer, critic, device)
+    return probs[0], hidden[0]
 
 # Set up logging to the console
 logger = logging.getLogger('discord')
@@ -115,10 +100,21 @@ class ModBot(discord.Client):
         intents.message_content = True
         super().__init__(command_prefix='.', intents=intents)
         self.group_num = None
-        self.mod_channels = {}  # Map from guild to the mod channel id for that guild
+        self.router = None  # ChannelRouter: channel id -> monitored / mod channel, built in on_ready
         self.reports = {}  # Map from user IDs to the state of their report
         self.reaction_to_report = {}
         self.past_reports = {}
+        # hidden vectors of past reports + moderator verdicts, for "similar past reports" lookups
+        self.similar_reports = ReportIndex(hidden_size)
+        # prioritised, bounded queue in front of the model; falls back to a keyword scorer under load
+        self.scoring = ScoringScheduler(self.score_text)
+        self.deferred_rescores = set()  # tasks re-scoring keyword fallback hits with the model
+        # decayed sums of recent scores per author and per (author, target) pair
+        self.author_risk = RiskTable(half_life=RISK_HALF_LIFE)
+        self.pair_risk = RiskTable(half_life=RISK_HALF_LIFE)
+        # moderator verdicts + hidden vectors, used to fine-tune the critic in the background
+        self.label_log = LabelLog(hidden_size)
+        self.critic_updates = None
 
     async def on_ready(self):
         print(f'{self.user.name} has connected to Discord! It is these guilds:')
@@ -133,11 +129,37 @@ class ModBot(discord.Client):
         else:
             raise Exception("Group number not found in bot's name. Name format should be \"Group # Bot\".")
 
-        # Find the mod channel in each guild that this bot should report to
+        # Index the monitored and mod channels in each guild once; the channel/guild events
+        # below keep it current, so messages never need to compare channel names
+        self.router = ChannelRouter(f'group-{self.group_num}', f'group-{self.group_num}-mod')
         for guild in self.guilds:
-            for channel in guild.text_channels:
-                if channel.name == f'group-{self.group_num}-mod':
-                    self.mod_channels[guild.id] = channel
+            self.router.add_guild(guild)
+
+        self.scoring.start()
+        # retrain the similar-reports IVF now if its saved copy was missing or unreadable
+        self.build_similar_index_if_needed()
+        if self.critic_updates is None:
+            self.critic_updates = asyncio.get_running_loop().create_task(self.update_critic_periodically())
+
+    async def on_guild_join(self, guild):
+        if self.router is not None:
+            self.router.add_guild(guild)
+
+    async def on_guild_remove(self, guild):
+        if self.router is not None:
+            self.router.remove_guild(guild)
+
+    async def on_guild_channel_create(self, channel):
+        if self.router is not None and isinstance(channel, discord.TextChannel):
+            self.router.add_channel(channel)
+
+    async def on_guild_channel_delete(self, channel):
+        if self.router is not None and isinstance(channel, discord.TextChannel):
+            self.router.remove_channel(channel)
+
+    async def on_guild_channel_update(self, before, after):
+        if self.router is not None and isinstance(after, discord.TextChannel):
+            self.router.update_channel(before, after)
 
     async def on_message(self, message):
         '''
@@ -201,8 +223,10 @@ class ModBot(discord.Client):
             if str(reaction.emoji) == "❌":
                 await reaction.message.channel.send("Report dismissed, closing report.")
                 report.state = State.REPORT_COMPLETE
+                await self.record_outcome(report, "dismissed")
         if report.state == State.DETERMINE_SEVERITY:
             if str(reaction.emoji) == "🔹":
+                await self.record_outcome(report, "minor")
                 if report.message.author.name not in self.past_reports:
                     self.past_reports[report.message.author.name] = 1
                 else:
@@ -237,6 +261,7 @@ class ModBot(discord.Client):
                         await reaction.message.channel.send("Report complete, closing report.")
                         report.state = State.REPORT_COMPLETE
             if str(reaction.emoji) == "🔷":
+                await self.record_outcome(report, "major")
                 await reaction.message.channel.send(
                     f"Simulating banning user {report.message.author.display_name}, major infraction")
                 await report.message.author.send(
@@ -250,15 +275,33 @@ class ModBot(discord.Client):
             self.reports.pop(report.author.id)
 
     async def handle_channel_message(self, message):
-        # Only handle messages sent in the "group-#" channel
-        if not message.channel.name == f'group-{self.group_num}':
+        if self.router is None:  # not ready yet
+            return
+
+        # Moderators can ask for the scoring queue counters from the mod channel
+        if message.content == SCORING_STATS_KEYWORD and self.router.is_mod_channel(message.channel.id):
+            await message.channel.send(self.scoring.format_stats())
+            return
+
+        # Only handle messages sent in the "group-#" channel of a guild that has a mod channel
+        mod_channel = self.router.route(message.channel.id)
+        if mod_channel is None:
             return
 
         # Forward the message to the mod channel
-        mod_channel = self.mod_channels[message.guild.id]
         await mod_channel.send(f'Forwarded message:\n{message.author.name}: "{message.content}"')
-        scores = self.eval_text(message.content)
+        scores, hidden, path = await self.scoring.submit(message.content, self.scoring_priority(message))
+        if path != "model":
+            await self.defer_fallback(message, mod_channel, scores, path)
+            return
         await mod_channel.send(self.code_format(scores))
+        await self.act_on_score(message, mod_channel, scores, hidden)
+
+    async def act_on_score(self, message, mod_channel, scores, hidden):
+        '''
+        Warn the channel, update rolling risk and auto-report based on a critic score.
+        Only ever called with model scores, never keyword fallback ones.
+        '''
         # if score is above 0.4 confidence warn channel that the message may be an instance of sextortion, to seek help 
         # not send nudes to people you don't trust HELP CHAT!
         if 0.4 < scores < 0.5:
@@ -269,9 +312,19 @@ class ModBot(discord.Client):
                                        " reach out to a loved one for support and cease complying with demands. If you feel comfortable,"
                                        " please report the user to law enforcement. Our content moderation team is already reviewing the situation."
                                        "  Additionally, if you are under the age of 18, you can go to https://takeitdown.ncmec.org/ to have all nude images of you removed from the internet.")
-        if scores > 0.5:
+
+        # rolling risk per author and per author -> target, so repeated borderline messages escalate too
+        now = time.time()
+        author_risk = self.author_risk.update(message.author.id, scores, now)
+        pair_key = (message.author.id, self.risk_target(message))
+        pair_risk = self.pair_risk.update(pair_key, scores, now)
+        sustained = max(author_risk, pair_risk) >= SUSTAINED_RISK_THRESHOLD
+
+        if scores > 0.5 or sustained:
             report = Report(self, self.user, initial_state=State.FINISHED_USER_REPORTING_FLOW)
             report.message = message
+            report.hidden = hidden
+            report.automatic = True
             self.reports[self.user.id] = report
             
             # update known violators
@@ -281,6 +334,14 @@ class ModBot(discord.Client):
             else:
                 knownViolators[message.author.name] = 0
             await mod_channel.send(f'Automatic report triggered from user {message.author.name}. User has {knownViolators[message.author.name]} previous automatic flags.')
+            if sustained:
+                await mod_channel.send(f'Sustained risk: rolling score {author_risk:.2f} for this user and {pair_risk:.2f} '
+                                       f'towards this target (threshold {SUSTAINED_RISK_THRESHOLD}).')
+                # start accumulating afresh so the next message doesn't immediately re-report
+                self.author_risk.reset(message.author.id)
+                self.pair_risk.reset(pair_key)
+            if hidden is not None:
+                await mod_channel.send(await self.similar_reports_message(hidden))
             self.TOS_check = await mod_channel.send(
                 f"Does the content violate our standing policies? Select yes (✅) or no (❌)")
             await self.TOS_check.add_reaction("✅")
@@ -288,14 +349,166 @@ class ModBot(discord.Client):
             report.state = State.AWAITING_MODERATION
             report.client.reaction_to_report[self.TOS_check.id] = report
 
+    async def defer_fallback(self, message, mod_channel, score, path):
+        '''
+        Keyword fallback scores are not calibrated like the critic's, so they never trigger
+        public warnings, auto-reports or rolling risk. Hits are shown to moderators and
+        re-scored by the model once the scoring queue has recovered.
+        '''
+        if score < FALLBACK_HIT_THRESHOLD:
+            return
+        if len(self.deferred_rescores) >= MAX_DEFERRED_RESCORES:
+            self.scoring.counters["rescore_dropped"] += 1
+            await mod_channel.send(f'Keyword fallback hit ({path}, {score:.2f}) on message from {message.author.name}. '
+                                   f'The re-score backlog is full, please review it manually: {message.jump_url}')
+            return
+        await mod_channel.send(f'Keyword fallback hit ({path}, {score:.2f}) on message from {message.author.name}. '
+                               f'It will be re-scored by the model once load drops.')
+        task = asyncio.get_running_loop().create_task(self.rescore_deferred(message, mod_channel))
+        self.deferred_rescores.add(task)
+        task.add_done_callback(self.deferred_rescores.discard)
+
+    async def rescore_deferred(self, message, mod_channel):
+        while True:
+            # wait out the overload before asking for model time again
+            while not self.scoring.has_capacity(Priority.BACKGROUND):
+                await asyncio.sleep(RESCORE_RETRY_SECONDS)
+            scores, hidden, path = await self.scoring.submit(message.content, Priority.BACKGROUND)
+            if path == "model":
+                break
+        self.scoring.counters["rescored"] += 1
+        await mod_channel.send(f'Model re-score of deferred message from {message.author.name}: {self.code_format(scores)}')
+        await self.act_on_score(message, mod_channel, scores, hidden)
+
     def eval_text(self, message):
         ''''
         TODO: Once you know how you want to evaluate messages in your channel,
         insert your code here! This will primarily be used in Milestone 3.
         '''
-        score = predict_sextortion(message)
+        score, _ = self.score_text(message)
         return score
 
+    def score_text(self, message):
+        '''
+        Score a channel message, returning (score, hidden). With USE_STUDENT the distilled
+        student scores it; anything it puts near or above the 0.5 cut-off is re-scored by
+        TinyLlama + critic, which also supplies the hidden vector reports need. hidden is
+        None when only the student ran.
+        '''
+        if student is None:
+            return predict_sextortion_with_hidden(message)
+        score = predict_student(student, message)
+        if TEACHER_RECHECK_MARGIN is not None and score >= 0.5 - TEACHER_RECHECK_MARGIN:
+            return predict_sextortion_with_hidden(message)
+        return score, None
+
+    def scoring_priority(self, message):
+        '''
+        Decide how urgently a channel message should be scored: authors with previous
+        automatic flags first, then new accounts and messages aimed at someone.
+        '''
+        if message.author.name in knownViolators:
+            return Priority.URGENT
+        if self.author_risk.get(message.author.id, time.time()) >= SUSTAINED_RISK_THRESHOLD / 2:
+            return Priority.HIGH
+        account_age = discord.utils.utcnow() - message.author.created_at
+        if account_age.days < NEW_ACCOUNT_DAYS:
+            return Priority.HIGH
+        if message.reference is not None or message.mentions or isinstance(message.channel, discord.Thread):
+            return Priority.HIGH
+        return Priority.NORMAL
+
+    def risk_target(self, message):
+        '''
+        Who a channel message is aimed at, for per author -> target risk: the author of the
+        message it replies to, else the first user it mentions, else the channel itself.
+        '''
+        if message.reference is not None and isinstance(message.reference.resolved, discord.Message):
+            return message.reference.resolved.author.id
+        if message.mentions:
+            return message.mentions[0].id
+        return message.channel.id
+
+    def eval_text_with_hidden(self, message):
+        '''
+        Like eval_text, but also returns the hidden vector the critic scored so it can be
+        stored with the report and looked up in self.similar_reports.
+        '''
+        return predict_sextortion_with_hidden(message)
+
+    async def hidden_for(self, text):
+        '''
+        TinyLlama hidden vector for text, which reports need even when the student or the
+        keyword fallback scored it. Runs on the scoring worker at URGENT priority, so it is
+        never shed and never competes with the worker for the model.
+        '''
+        _, hidden, _ = await self.scoring.submit(text, Priority.URGENT, score_fn=self.eval_text_with_hidden)
+        return hidden
+
+    async def similar_reports_message(self, hidden):
+        '''
+        Mod-channel summary of the past reports most similar to hidden. The index search runs
+        in a worker thread (it takes its lock and a few ms of numpy) so it never blocks the event loop.
+        '''
+        results = await asyncio.get_running_loop().run_in_executor(None, self.similar_reports.search, hidden)
+        return format_similar(results)
+
+    async def record_outcome(self, report, verdict):
+        '''
+        Store a moderated report's hidden vector with the moderator's verdict so future
+        reports can be matched against it, and append it to the label log the critic is
+        fine-tuned on, tagged with what the report was about (automatic, or the user's
+        report category) so only sextortion reports become positives. The TinyLlama forward pass (when the report has no hidden vector yet)
+        goes through the scoring queue, and IVF/PQ index training runs in a worker thread,
+        so neither blocks the event loop.
+        '''
+        if report.message is None:
+            return
+        if report.hidden is None:
+            # scored by the keyword fallback or the student alone; one forward pass to label it
+            report.hidden = await self.hidden_for(report.message.content)
+        category = "automatic" if report.automatic else report_category(report.report_path)
+        self.label_log.append(report.hidden, verdict, category)
+        self.similar_reports.add(report.hidden, verdict, report.message.author.name, report.message.content)
+        self.build_similar_index_if_needed()
+
+    def build_similar_index_if_needed(self):
+        '''Train the similar-reports IVF/PQ index in a worker thread once it is due.'''
+        if self.similar_reports.needs_build():
+            self.similar_reports.building = True
+            asyncio.get_running_loop().run_in_executor(None, self.similar_reports.build_ivf)
+
+    async def update_critic_periodically(self):
+        '''
+        Every CRITIC_UPDATE_INTERVAL seconds, if at least CRITIC_UPDATE_MIN_LABELS new verdicts
+        have been logged, fine-tune the critic on the cached hidden vectors in a worker thread
+        and hot-swap it in if it passes the validation gate on the test split. How many labels
+        the last run saw is kept on disk, so labels logged before a restart still count.
+        '''
+        loop = asyncio.get_running_loop()
+        trained_on = load_trained_on()
+        while True:
+            await asyncio.sleep(CRITIC_UPDATE_INTERVAL)
+            logged = len(self.label_log)
+            if logged - trained_on < CRITIC_UPDATE_MIN_LABELS:
+                continue
+            try:
+                new_critic, metrics = await loop.run_in_executor(None, finetune_live_critic, self.label_log)
+            except Exception:
+                # trained_on is left alone, so the next check retries these labels
+                logger.exception("Critic fine-tuning failed")
+                continue
+            # only a completed run (swapped in or rejected by the gate) counts its labels as used
+            trained_on = logged
+            if new_critic is None:
+                save_trained_on(trained_on)
+                print(f"Fine-tuned critic rejected by validation gate: {metrics}")
+                continue
+            swap_critic(new_critic)
+            torch.save(new_critic.state_dict(), ONLINE_CRITIC_PATH)
+            save_trained_on(trained_on)
+            print(f"Swapped in critic fine-tuned on {metrics['labels']} moderator labels: {metrics}")
+
     def code_format(self, text):
         ''''
         TODO: Once you know how you want to show that a message has been
@@ -0,0 +1,179 @@
+# distill.py
+# Distil the TinyLlama + Critic teacher into the small StudentCNN in student.py.
+#
+#   python distill.py label corpus.jsonl [more corpora...]   # teacher scores -> distill_labels.jsonl
+#   python distill.py train                                  # fit student on the teacher's scores
+#   python distill.py eval                                   # student vs data/sextortion_test.csv
+#
+# Corpora are unlabeled message dumps: .jsonl with a 'content' (or 'text') field per line, .csv with
+# a 'text' column, or plain text with one message per line.
+import argparse
+import csv
+import json
+import os
+import random
+import time
+import torch
+import torch.nn as nn
+import pandas as pd
+from student import STUDENT_PATH, StudentCNN, encode, load_student, predict_student
+
+LABELS_PATH = "distill_labels.jsonl"
+TRAIN_CSV = "data/sextortion_train.csv"
+TEST_CSV = "data/sextortion_test.csv"
+
+
+def _read_corpus(path):
+    if path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                text = record.get("content") or record.get("text")
+                if text:
+                    yield text
+    elif path.endswith(".csv"):
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                if row.get("text"):
+                    yield row["text"]
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield line.strip()
+
+
+def label(corpora, labels_path=LABELS_PATH, batch_size=32):
+    """Score every corpus message with the teacher and append (text, teacher prob) to labels_path."""
+    from scorer import load_scorer, score_batch
+    teacher = load_scorer()
+
+    # skip messages already labelled by a previous (possibly interrupted) run
+    done = set()
+    if os.path.isfile(labels_path):
+        with open(labels_path, "r", encoding="utf-8") as f:
+            done = {json.loads(line)["text"] for line in f if line.strip()}
+
+    started = time.time()
+    count = 0
+    with open(labels_path, "a", encoding="utf-8") as out:
+        for path in corpora:
+            batch = []
+            for text in _read_corpus(path):
+                if text in done:
+                    continue
+                done.add(text)
+                batch.append(text)
+                if len(batch) == batch_size:
+                    count += _write_labels(out, batch, score_batch(batch, *teacher)[0])
+                    batch = []
+            if batch:
+                count += _write_labels(out, batch, score_batch(batch, *teacher)[0])
+            print(f"labelled {path}: {count} messages so far, {count / (time.time() - started):.1f} messages/sec")
+
+
+def _write_labels(out, texts, probs):
+    for text, prob in zip(texts, probs):
+        out.write(json.dumps({"text": text, "teacher": round(prob, 4)}, ensure_ascii=False) + "\n")
+    out.flush()
+    return len(texts)
+
+
+def train(labels_path=LABELS_PATH, student_path=STUDENT_PATH, epochs=10, batch_size=64,
+          learning_rate=1e-3, seed=0):
+    """
+    Fit the student to the teacher's soft scores (BCE against the teacher probability).
+    The hand-labelled training split is added with hard 0/1 targets so the student never
+    trains on less than the teacher did.
+    """
+    random.seed(seed)
+    torch.manual_seed(seed)
+    examples = []
+    with open(labels_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                examples.append((record["text"], record["teacher"]))
+    train_df = pd.read_csv(TRAIN_CSV)
+    for text, lab in zip(train_df["text"], train_df["label"]):
+        examples.append((text, 1.0 if lab == "sextortion" else 0.0))
+    print(f"training student on {len(examples)} messages")
+
+    student = StudentCNN()
+    optimizer = torch.optim.AdamW(student.parameters(), lr=learning_rate)
+    criterion = nn.BCEWithLogitsLoss()
+    for epoch in range(epochs):
+        random.shuffle(examples)
+        total = 0.0
+        student.train()
+        for i in range(0, len(examples), batch_size):
+            batch = examples[i:i + batch_size]
+            logits = student(encode([text for text, _ in batch])).view(-1)
+            targets = torch.tensor([target for _, target in batch], dtype=torch.float)
+            loss = criterion(logits, targets)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total += loss.item() * len(batch)
+        print(f"epoch {epoch}: loss {total / len(examples):.4f}")
+
+    torch.save(student.state_dict(), student_path)
+    print(f"Saved student weights to {student_path}")
+
+
+def evaluate(student_path=STUDENT_PATH, threshold=0.5):
+    """Same metrics as 152Test.py's eval(), plus single-message CPU latency."""
+    torch.set_num_threads(1)
+    student = load_student(student_path)
+    test_df = pd.read_csv(TEST_CSV)
+
+    true_pos = false_pos = true_neg = false_neg = 0
+    latencies = []
+    for text, lab in zip(test_df["text"], test_df["label"]):
+        start = time.perf_counter()
+        score = predict_student(student, text)
+        latencies.append(time.perf_counter() - start)
+        if score > threshold:
+            if lab == "sextortion":
+                true_pos += 1
+            else:
+                false_pos += 1
+        else:
+            if lab == "not_sextortion":
+                true_neg += 1
+            else:
+                false_neg += 1
+
+    num_pos = max(true_pos + false_neg, 1)
+    num_neg = max(true_neg + false_pos, 1)
+    latencies.sort()
+    print("Student eval results:")
+    print("false neg / miss rate: ", false_neg / num_pos)
+    print("true neg:", true_neg / num_neg)
+    print("false pos", false_pos / num_neg)
+    print("true pos", true_pos / num_pos)
+    print("total accuracy", (true_pos + true_neg) / len(test_df))
+    print(f"latency per message (1 CPU thread): median {latencies[len(latencies) // 2] * 1000:.3f} ms, "
+          f"max {latencies[-1] * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distil the TinyLlama critic into a small student model.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    label_parser = sub.add_parser("label", help="score unlabeled corpora with the teacher")
+    label_parser.add_argument("corpora", nargs="+")
+    label_parser.add_argument("--batch-size", type=int, default=32)
+    train_parser = sub.add_parser("train", help="train the student on the teacher's scores")
+    train_parser.add_argument("--epochs", type=int, default=10)
+    sub.add_parser("eval", help=f"evaluate the student on {TEST_CSV}")
+    args = parser.parse_args()
+
+    if args.command == "label":
+        label(args.corpora, batch_size=args.batch_size)
+    elif args.command == "train":
+        train(epochs=args.epochs)
+    else:
+        evaluate()
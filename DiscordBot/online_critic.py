@@ -0,0 +1,156 @@
+# online_critic.py
+# Moderator verdicts as training labels: every moderated report's TinyLlama hidden vector is
+# appended to a compact label log, and the critic is periodically fine-tuned on those cached
+# vectors (no backbone forward passes), then only swapped in if it does at least as well on
+# the test split as the critic it replaces.
+import copy
+import json
+import os
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn as nn
+
+LABEL_LOG_PATH = "moderator_labels.bin"
+VAL_FEATURES_PATH = "test_features.npz"
+ONLINE_CRITIC_PATH = "critic_sextortion_online.pt"
+TRAINED_ON_PATH = "critic_sextortion_online.json"  # label log length at the last fine-tuning run
+TEST_CSV = "data/sextortion_test.csv"
+
+# moderator verdicts as recorded by ModBot.record_outcome
+VERDICT_CODES = {"dismissed": 0, "minor": 1, "major": 2}
+# what a report was about. An upheld report is only a sextortion positive if it is an automatic
+# (critic-triggered) report or a user report in a sextortion category; upheld reports of anything
+# else (hate speech, violence, ...) say nothing about sextortion and are left out of training.
+# Dismissals are negatives whatever the category. Records logged before categories existed are "other".
+CATEGORY_CODES = {"other": 0, "sextortion": 1, "automatic": 2}
+# user_report_tree.json choices that make a user report a sextortion report
+SEXTORTION_REPORT_CHOICES = {
+    "Sexually Explicit",
+    "Someone is threateneing to share my nude images/content",
+}
+
+
+def report_category(report_path):
+    """Category of a user report from the choices made in user_report_tree.json."""
+    if SEXTORTION_REPORT_CHOICES.intersection(report_path):
+        return "sextortion"
+    return "other"
+
+
+class LabelLog:
+    """
+    Append-only binary log of (code, float16 hidden vector) records, 1 + 2 * dim bytes each.
+    The code byte holds the verdict in its low four bits and the report category in its high
+    four, so logs written before categories existed read back as category "other".
+    A partially written trailing record (crash mid-append) is ignored on read.
+    """
+
+    def __init__(self, dim, path=LABEL_LOG_PATH):
+        self.path = path
+        self.dtype = np.dtype([("verdict", np.uint8), ("hidden", np.float16, (dim,))])
+
+    def __len__(self):
+        if not os.path.isfile(self.path):
+            return 0
+        return os.path.getsize(self.path) // self.dtype.itemsize
+
+    def append(self, hidden, verdict, category="other"):
+        record = np.zeros(1, dtype=self.dtype)
+        record["verdict"] = VERDICT_CODES[verdict] | CATEGORY_CODES[category] << 4
+        record["hidden"] = np.asarray(hidden, dtype=np.float32).reshape(-1)
+        with open(self.path, "ab") as f:
+            f.write(record.tobytes())
+
+    def read(self):
+        """
+        Returns (hidden [n, dim] float32, labels [n] float32 with 1.0 = sextortion) for the
+        records usable as sextortion labels; see CATEGORY_CODES.
+        """
+        records = np.fromfile(self.path, dtype=self.dtype, count=len(self))
+        upheld = (records["verdict"] & 0x0F) > 0
+        category = records["verdict"] >> 4
+        keep = ~upheld | (category == CATEGORY_CODES["sextortion"]) | (category == CATEGORY_CODES["automatic"])
+        return records["hidden"][keep].astype(np.float32), upheld[keep].astype(np.float32)
+
+
+def load_trained_on(path=TRAINED_ON_PATH):
+    """Number of label log records the last fine-tuning run saw (0 if there has been none)."""
+    if not os.path.isfile(path):
+        return 0
+    with open(path, "r") as f:
+        return json.load(f)["trained_on"]
+
+
+def save_trained_on(count, path=TRAINED_ON_PATH):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"trained_on": count}, f)
+    os.replace(tmp, path)
+
+
+def validation_features(model, tokenizer, critic, device, path=VAL_FEATURES_PATH, batch_size=8):
+    """
+    Hidden vectors and 0/1 labels for the test split. The backbone runs over the test split
+    once; after that the features are read back from `path`.
+    """
+    if os.path.isfile(path):
+        saved = np.load(path)
+        return saved["hidden"], saved["labels"]
+    from scorer import score_batch
+    test_df = pd.read_csv(TEST_CSV)
+    texts = list(test_df["text"])
+    hidden = np.concatenate([
+        score_batch(texts[i:i + batch_size], model, tokenizer, critic, device)[1]
+        for i in range(0, len(texts), batch_size)
+    ])
+    labels = (test_df["label"] == "sextortion").to_numpy(dtype=np.float32)
+    np.savez(path, hidden=hidden, labels=labels)
+    return hidden, labels
+
+
+def evaluate(critic, hidden, labels, device, threshold=0.5):
+    """Returns (accuracy, miss rate) of critic on cached hidden vectors."""
+    with torch.no_grad():
+        probs = torch.sigmoid(critic(torch.from_numpy(hidden).to(device)).view(-1)).cpu().numpy()
+    predicted = probs > threshold
+    positives = labels > 0.5
+    accuracy = float((predicted == positives).mean())
+    miss_rate = float((~predicted & positives).sum() / max(positives.sum(), 1))
+    return accuracy, miss_rate
+
+
+def finetune(critic, label_log, val_hidden, val_labels, device, epochs=5, batch_size=32,
+             learning_rate=1e-5):
+    """
+    Fine-tune a copy of critic on the label log's cached hidden vectors.
+    Returns (new_critic or None, metrics): new_critic is None when it fails the validation
+    gate, i.e. is less accurate or misses more sextortion on the test split than critic.
+    """
+    hidden, labels = label_log.read()
+    candidate = copy.deepcopy(critic).to(device)
+    candidate.train()
+    optimizer = torch.optim.AdamW(candidate.parameters(), lr=learning_rate)
+    criterion = nn.BCEWithLogitsLoss()
+    hidden_t = torch.from_numpy(hidden).to(device)
+    labels_t = torch.from_numpy(labels).to(device)
+    for _ in range(epochs):
+        order = torch.randperm(len(hidden_t), device=device)
+        for i in range(0, len(order), batch_size):
+            batch = order[i:i + batch_size]
+            loss = criterion(candidate(hidden_t[batch]).view(-1), labels_t[batch])
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+    candidate.eval()
+
+    old_accuracy, old_miss = evaluate(critic, val_hidden, val_labels, device)
+    new_accuracy, new_miss = evaluate(candidate, val_hidden, val_labels, device)
+    metrics = {
+        "labels": len(hidden),
+        "old_accuracy": old_accuracy, "new_accuracy": new_accuracy,
+        "old_miss_rate": old_miss, "new_miss_rate": new_miss,
+    }
+    if new_accuracy < old_accuracy or new_miss > old_miss:
+        return None, metrics
+    return candidate, metrics
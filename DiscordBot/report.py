@@ -26,6 +26,8 @@ class Report:
         self.client = client
         self.author = author
         self.message = None
+        self.hidden = None  # TinyLlama hidden vector of self.message, set once it has been scored
+        self.automatic = False  # raised by the critic rather than by a user
         with open("user_report_tree.json", "r") as f:
             self.user_report_tree = json.load(f)
 
@@ -131,13 +133,13 @@ class Report:
             self.state = State.FINISHED_USER_REPORTING_FLOW
 
         if self.state == State.FINISHED_USER_REPORTING_FLOW:
-            mod_channel = None
-            for guild in self.client.guilds:
-                if self.message.guild.id in self.client.mod_channels:
-                    mod_channel = self.client.mod_channels[self.message.guild.id]
-                    break
+            if self.client.router is None:
+                # channel index is built in on_ready; stay in this state so the next message retries
+                return ["The bot is still starting up and can't reach the moderators yet. Please send any message in a moment to submit your report."]
+            mod_channel = self.client.router.mod_channel_for(self.message.guild.id)
 
             if mod_channel:
+                self.hidden = await self.client.hidden_for(self.message.content)
                 report_notification = "🚨 A user has submitted a report!"
                 report_notification += "🚨 A user has submitted a report!"
                 report_notification += f"Reported message from {self.message.author.display_name}:"
@@ -152,6 +154,7 @@ class Report:
                 author_information += f"Additional details provided by author:\n{self.author_message}\n"
                 author_information += "------------------------------------------\n"
                 await mod_channel.send(report_notification + author_information)
+                await mod_channel.send(await self.client.similar_reports_message(self.hidden))
 
                 self.TOS_check = await mod_channel.send(f"Does the content violate our standing policies? Select yes (✅) or no (❌)")
                 await self.TOS_check.add_reaction("✅")
@@ -0,0 +1,83 @@
+# risk.py
+# Rolling per-key risk: an exponentially decayed sum of critic scores, so several
+# borderline messages from the same author (or aimed at the same target) add up
+# to an escalation even when no single message crosses the report threshold.
+import math
+from array import array
+
+
+class RiskTable:
+    """
+    risk(t) = sum over messages i of max(0, score_i - floor) * 0.5 ** ((t - t_i) / half_life)
+
+    Only the current risk and the time it was last updated are stored per key, so an
+    update is O(1): decay the stored value to now, then add the new score. Values live
+    in two flat float arrays indexed by slot; a dict maps keys to slots and freed slots
+    are reused. Every update also checks `sweep` slots round-robin and evicts keys not
+    updated for `ttl` seconds, so idle keys are dropped without a full scan.
+    """
+
+    def __init__(self, half_life=3600.0, floor=0.2, ttl=7 * 24 * 3600.0, sweep=2):
+        self.decay = math.log(2) / half_life
+        self.floor = floor      # scores at or below this never accumulate (ordinary chat)
+        self.ttl = ttl
+        self.sweep = sweep
+        self._slots = {}        # key -> slot
+        self._keys = []         # slot -> key, None for a free slot
+        self._risk = array("d")
+        self._updated = array("d")
+        self._free = []
+        self._cursor = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def update(self, key, score, now):
+        """Add one message's score for key at time now (seconds) and return the new risk."""
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._allocate(key)
+            risk = 0.0
+        else:
+            risk = self._risk[slot] * math.exp(-self.decay * (now - self._updated[slot]))
+        risk += max(0.0, score - self.floor)
+        self._risk[slot] = risk
+        self._updated[slot] = now
+        self._evict_idle(now)
+        return risk
+
+    def get(self, key, now):
+        """Current risk for key without adding anything (0 for unknown keys)."""
+        slot = self._slots.get(key)
+        if slot is None:
+            return 0.0
+        return self._risk[slot] * math.exp(-self.decay * (now - self._updated[slot]))
+
+    def reset(self, key):
+        """Clear key's risk, e.g. once it has triggered a report."""
+        slot = self._slots.get(key)
+        if slot is not None:
+            self._risk[slot] = 0.0
+
+    def _allocate(self, key):
+        if self._free:
+            slot = self._free.pop()
+            self._keys[slot] = key
+        else:
+            slot = len(self._keys)
+            self._keys.append(key)
+            self._risk.append(0.0)
+            self._updated.append(0.0)
+        self._slots[key] = slot
+        return slot
+
+    def _evict_idle(self, now):
+        n = len(self._keys)
+        for _ in range(min(self.sweep, n)):
+            slot = self._cursor
+            self._cursor = (self._cursor + 1) % n
+            key = self._keys[slot]
+            if key is not None and now - self._updated[slot] > self.ttl:
+                del self._slots[key]
+                self._keys[slot] = None
+                self._free.append(slot)
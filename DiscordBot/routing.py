@@ -0,0 +1,131 @@
+# routing.py
+# Index from channel IDs to their role (monitored "group-#" channel or "group-#-mod" channel),
+# built once at startup and kept current from gateway channel/guild events, so per-message
+# routing is a dict lookup instead of string compares and scans over every guild.
+
+
+class ChannelRouter:
+    def __init__(self, monitored_name, mod_name):
+        self.monitored_name = monitored_name
+        self.mod_name = mod_name
+        self.routes = {}        # monitored channel id -> its guild's mod channel (None if the guild has none)
+        self.mod_channels = {}  # guild id -> mod channel
+        self._monitored_by_guild = {}  # guild id -> set of monitored channel ids
+        self._mod_ids = set()   # ids of channels currently in mod_channels
+
+    # ------------------------------------------------------------------ updates
+
+    def add_guild(self, guild):
+        for channel in guild.text_channels:
+            self.add_channel(channel)
+
+    def remove_guild(self, guild):
+        for channel_id in self._monitored_by_guild.pop(guild.id, ()):
+            self.routes.pop(channel_id, None)
+        mod_channel = self.mod_channels.pop(guild.id, None)
+        if mod_channel is not None:
+            self._mod_ids.discard(mod_channel.id)
+
+    def add_channel(self, channel):
+        guild_id = channel.guild.id
+        if channel.name == self.monitored_name:
+            self._monitored_by_guild.setdefault(guild_id, set()).add(channel.id)
+            self.routes[channel.id] = self.mod_channels.get(guild_id)
+        elif channel.name == self.mod_name and guild_id not in self.mod_channels:
+            self._set_mod_channel(guild_id, channel)
+
+    def remove_channel(self, channel):
+        guild_id = channel.guild.id
+        if self.routes.pop(channel.id, False) is not False:
+            self._monitored_by_guild[guild_id].discard(channel.id)
+        if channel.id in self._mod_ids:
+            self._set_mod_channel(guild_id, None)
+            # rare: fall back to another channel with the mod name in the same guild, if any
+            for other in channel.guild.text_channels:
+                if other.id != channel.id and other.name == self.mod_name:
+                    self._set_mod_channel(guild_id, other)
+                    break
+
+    def update_channel(self, before, after):
+        # renames can move a channel in or out of either role
+        self.remove_channel(before)
+        self.add_channel(after)
+
+    def _set_mod_channel(self, guild_id, channel):
+        old = self.mod_channels.pop(guild_id, None)
+        if old is not None:
+            self._mod_ids.discard(old.id)
+        if channel is not None:
+            self.mod_channels[guild_id] = channel
+            self._mod_ids.add(channel.id)
+        for channel_id in self._monitored_by_guild.get(guild_id, ()):
+            self.routes[channel_id] = channel
+
+    # ------------------------------------------------------------------ lookups
+
+    def is_monitored(self, channel_id):
+        return channel_id in self.routes
+
+    def is_mod_channel(self, channel_id):
+        return channel_id in self._mod_ids
+
+    def mod_channel_for(self, guild_id):
+        return self.mod_channels.get(guild_id)
+
+    def route(self, channel_id):
+        """Mod channel that messages in channel_id should be forwarded to, or None if unmonitored."""
+        return self.routes.get(channel_id)
+
+
+if __name__ == "__main__":
+    # benchmark: python routing.py [guilds] [channels per guild]
+    import sys
+    import time
+    from types import SimpleNamespace
+
+    n_guilds = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    per_guild = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    group_num = "11"
+    monitored_name, mod_name = f"group-{group_num}", f"group-{group_num}-mod"
+
+    guilds = []
+    next_id = 0
+    for g in range(n_guilds):
+        guild = SimpleNamespace(id=g, text_channels=[])
+        for c in range(per_guild):
+            name = monitored_name if c == 0 else mod_name if c == 1 else f"general-{c}"
+            guild.text_channels.append(SimpleNamespace(id=next_id, name=name, guild=guild))
+            next_id += 1
+        guilds.append(guild)
+    messages = [guilds[i % n_guilds].text_channels[i % per_guild] for i in range(200_000)]
+
+    # before: scan every channel at startup into guild -> mod channel
+    start = time.perf_counter()
+    old_mod_channels = {}
+    for guild in guilds:
+        for channel in guild.text_channels:
+            if channel.name == mod_name:
+                old_mod_channels[guild.id] = channel
+    old_build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    router = ChannelRouter(monitored_name, mod_name)
+    for guild in guilds:
+        router.add_guild(guild)
+    new_build = time.perf_counter() - start
+    print(f"startup scan, {n_guilds * per_guild} channels: "
+          f"old {old_build * 1000:.1f} ms, router {new_build * 1000:.1f} ms")
+
+    # before: build the channel name and compare it per message, then look up the guild's mod channel
+    start = time.perf_counter()
+    for channel in messages:
+        if channel.name == f'group-{group_num}':
+            mod_channel = old_mod_channels[channel.guild.id]
+    old_lookup = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for channel in messages:
+        mod_channel = router.route(channel.id)
+    new_lookup = time.perf_counter() - start
+    print(f"per-message lookup: old {old_lookup / len(messages) * 1e9:.0f} ns, "
+          f"router {new_lookup / len(messages) * 1e9:.0f} ns")
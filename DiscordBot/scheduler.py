@@ -0,0 +1,159 @@
+# scheduler.py
+# Priority admission queue in front of the TinyLlama + critic scorer, so a real extortion
+# message is not stuck behind thousands of benign ones during a raid or spam wave.
+import asyncio
+import collections
+import itertools
+import re
+import time
+from enum import IntEnum
+
+
+class Priority(IntEnum):
+    # lower value is scored first
+    URGENT = 0      # author already has automatic flags, or a report needs its hidden vector
+    HIGH = 1        # new account, message aimed at someone (reply / mention / thread), or rising author risk
+    NORMAL = 2
+    BACKGROUND = 3  # deferred model re-scores of keyword fallback hits
+
+
+# cheap fallback: weighted keyword patterns typical of extortion demands
+_CHEAP_PATTERNS = [
+    (re.compile(r"\b(nudes?|naked|pics?|pictures?|photos?|videos?|intimate|explicit)\b", re.I), 0.2),
+    (re.compile(r"\b(leak|share|post|send|expose|release|spread)\b", re.I), 0.15),
+    (re.compile(r"\b(parents?|family|school|friends|followers|contacts?|everyone)\b", re.I), 0.15),
+    # "$500" has no word boundary before the "$", so the amount sits outside the \b group
+    (re.compile(r"\b(pay|money|bitcoin|btc|gift ?cards?|venmo|cashapp|paypal)\b|\$\s?\d+", re.I), 0.25),
+    (re.compile(r"\b(or else|unless|if you don'?t|last chance|final warning|deadline|by tonight)\b", re.I), 0.25),
+]
+
+
+def cheap_score(text):
+    """
+    Keyword heuristic in [0,1]; microseconds per message, used when the model is overloaded.
+    It is not calibrated like the critic, so callers must not apply the critic's cut-offs to it.
+    """
+    return min(1.0, sum(weight for pattern, weight in _CHEAP_PATTERNS if pattern.search(text)))
+
+
+class ScoringScheduler:
+    """
+    Bounded priority queue feeding a single model worker.
+
+    - Admission: URGENT messages are never shed; they wait for space when the queue is
+      full (backpressure on the caller). Every other class is shed straight to cheap_score
+      once it would take more than its share of the queue: HIGH may hold `high_share` of
+      it, NORMAL all of it, and BACKGROUND is only admitted while the queue is under
+      `background_share` full, so re-scores never crowd out live messages.
+    - Degraded mode: queue wait is tracked as an EWMA. While it is above `slo` seconds,
+      NORMAL and BACKGROUND messages skip the queue and use cheap_score; the mode clears
+      once the EWMA falls under half the SLO or the queue drains. HIGH messages are
+      shed the same way while the EWMA is above the looser `high_slo`, so a raid of new
+      accounts mentioning people cannot monopolise the model either.
+    - Expiry: a message that already waited longer than its class's SLO when dequeued
+      (`high_slo` for HIGH, `slo` below that) is scored cheaply rather than spending
+      model time on it.
+
+    `counters` counts how often each path was taken, keyed "<path>:<priority>".
+    """
+
+    def __init__(self, score_fn, maxsize=1000, slo=2.0, high_slo=5.0, high_share=0.2,
+                 background_share=0.25, ewma_alpha=0.2):
+        self.score_fn = score_fn   # blocking text -> (prob, hidden), run in a worker thread
+        self.queue = asyncio.PriorityQueue(maxsize)
+        self.slo = slo
+        self.high_slo = high_slo
+        self.high_share = high_share
+        self.background_share = background_share
+        self.queued = collections.Counter()  # messages currently in the queue, per priority
+        self.ewma_alpha = ewma_alpha
+        self.wait_ewma = 0.0
+        self.degraded = False
+        self.counters = collections.Counter()
+        self._seq = itertools.count()  # tie-breaker so equal priorities stay FIFO
+        self._worker = None
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, text, priority=Priority.NORMAL, score_fn=None):
+        """
+        Score text, returning (prob, hidden, path). hidden is None when the cheap scorer
+        was used, since no model forward pass happened. score_fn overrides the scheduler's
+        scorer for this one message, so other model work can share the queue and worker.
+        """
+        if self.degraded and self.queue.empty():
+            self.degraded = False
+        rejected = self._admission(priority)
+        if rejected is not None:
+            return self._cheap(text, rejected, priority)
+
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((priority, next(self._seq), time.monotonic(), text, score_fn or self.score_fn, future))
+        # counted only once put() returns (it cannot yield after enqueuing), so a caller
+        # cancelled while waiting for space is never counted
+        self.queued[priority] += 1
+        return await future
+
+    def has_capacity(self, priority=Priority.NORMAL):
+        """True when a submit at priority would reach the model rather than the cheap scorer."""
+        return self._admission(priority) is None
+
+    def _admission(self, priority):
+        # None if priority may be queued right now, else the cheap path it is shed to
+        if priority == Priority.URGENT:
+            return None
+        busy = not self.queue.empty()
+        if priority == Priority.HIGH:
+            if busy and self.wait_ewma > self.high_slo:
+                return "degraded"
+            if self.queued[Priority.HIGH] >= self.high_share * self.queue.maxsize:
+                return "shed"
+            return None
+        if busy and self.degraded:
+            return "degraded"
+        share = 1.0 if priority == Priority.NORMAL else self.background_share
+        if self.queue.qsize() >= share * self.queue.maxsize:
+            return "shed"
+        return None
+
+    def _cheap(self, text, path, priority):
+        self.counters[f"{path}:{priority.name}"] += 1
+        return cheap_score(text), None, path
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            priority, _, enqueued, text, score_fn, future = await self.queue.get()
+            self.queued[priority] -= 1
+            wait = time.monotonic() - enqueued
+            self.wait_ewma += self.ewma_alpha * (wait - self.wait_ewma)
+            if self.wait_ewma > self.slo:
+                self.degraded = True
+            elif self.wait_ewma < self.slo / 2:
+                self.degraded = False
+
+            if future.cancelled():
+                continue
+            limit = self.high_slo if priority == Priority.HIGH else self.slo
+            if priority != Priority.URGENT and wait > limit:
+                future.set_result(self._cheap(text, "expired", priority))
+                continue
+            try:
+                prob, hidden = await loop.run_in_executor(None, score_fn, text)
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+                continue
+            self.counters[f"model:{priority.name}"] += 1
+            if not future.cancelled():
+                future.set_result((prob, hidden, "model"))
+
+    def format_stats(self):
+        lines = [f"Scoring queue: {self.queue.qsize()}/{self.queue.maxsize} queued, "
+                 f"wait EWMA {self.wait_ewma:.2f}s (SLO {self.slo:.1f}s), "
+                 f"{'DEGRADED' if self.degraded else 'normal'} mode"]
+        for key, count in sorted(self.counters.items()):
+            lines.append(f"` {key} ` {count}")
+        return "\n".join(lines)
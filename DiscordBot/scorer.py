@@ -0,0 +1,81 @@
+# scorer.py
+# TinyLlama + Critic scoring, shared by the bot and the offline tools.
+import torch
+import torch.nn as nn
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+BASE_MODEL_NAME = "TinyLlama/TinyLlama-1.1B-Chat-v1.0"
+CRITIC_PATH = "critic_sextortion.pt"
+
+
+class Critic(nn.Module):
+    def __init__(self, hidden_size):
+        super().__init__()
+        self.critic = nn.Sequential(
+            nn.Linear(hidden_size, 2048),
+            nn.ReLU(),
+            nn.Linear(2048, 2048),
+            nn.ReLU(),
+            nn.Linear(2048, 1)
+        )
+
+    def forward(self, hidden_vec):
+        return self.critic(hidden_vec)   # returns shape [batch_size, 1]
+
+
+def load_scorer(device=None, critic_path=CRITIC_PATH):
+    """
+    Load TinyLlama, its tokenizer and the trained critic.
+    Returns (model, tokenizer, critic, device).
+    """
+    if device is None:
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = AutoModelForCausalLM.from_pretrained(
+        BASE_MODEL_NAME,
+        output_hidden_states=True
+    ).to(device)
+    model.eval()
+
+    tokenizer = AutoTokenizer.from_pretrained(
+        BASE_MODEL_NAME,
+        padding_side="left"
+    )
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    critic = Critic(model.config.hidden_size).to(device)
+    critic.load_state_dict(torch.load(critic_path, map_location=device))
+    critic.eval()
+    return model, tokenizer, critic, device
+
+
+def score_batch(texts, model, tokenizer, critic, device, max_length=None):
+    """
+    Score a list of messages in one forward pass.
+    Returns (probs, hidden): a list of floats in [0,1] and a float32 numpy array
+    [len(texts), hidden_size] of the last-token hidden states the critic scored.
+    """
+    toks = tokenizer(
+        texts,
+        return_tensors="pt",
+        padding=True,
+        truncation=True,
+        max_length=max_length
+    )
+    input_ids      = toks["input_ids"].to(device)       # [batch, seq_len]
+    attention_mask = toks["attention_mask"].to(device)
+    # messages are left padded, so count positions from each message's first real token
+    position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+
+    with torch.no_grad():
+        outputs = model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            output_hidden_states=True,
+            return_dict=True
+        )
+        # left padding puts every message's real last token in the final position
+        last_token_hidden = outputs.hidden_states[-1][:, -1, :]    # [batch, hidden_size]
+        probs = torch.sigmoid(critic(last_token_hidden).view(-1))
+    return probs.cpu().tolist(), last_token_hidden.float().cpu().numpy()
@@ -0,0 +1,390 @@
+# similar_reports.py
+# Nearest-neighbour index over the TinyLlama last-token hidden vectors of past reports,
+# so moderators can see how similar-looking reports were resolved before.
+import json
+import os
+import threading
+import time
+import zipfile
+import numpy as np
+
+
+class _Growable:
+    """Append-only numpy array with amortised O(1) appends (capacity doubles when full)."""
+
+    def __init__(self, row_shape, dtype, capacity=1024):
+        self._data = np.empty((capacity, *row_shape), dtype=dtype)
+        self.size = 0
+
+    def append(self, rows):
+        rows = np.asarray(rows, dtype=self._data.dtype)
+        n = len(rows)
+        if self.size + n > len(self._data):
+            grown = np.empty((max(2 * len(self._data), self.size + n), *self._data.shape[1:]), dtype=self._data.dtype)
+            grown[:self.size] = self._data[:self.size]
+            self._data = grown
+        self._data[self.size:self.size + n] = rows
+        self.size += n
+
+    def view(self):
+        return self._data[:self.size]
+
+
+def _nearest(x, centroids, chunk=8192):
+    # argmin ||x - c||^2 == argmin ||c||^2 - 2 x.c  (||x||^2 is the same for every centroid)
+    c_norms = (centroids ** 2).sum(axis=1)
+    out = np.empty(len(x), dtype=np.int64)
+    for i in range(0, len(x), chunk):
+        out[i:i + chunk] = (c_norms - 2.0 * (x[i:i + chunk] @ centroids.T)).argmin(axis=1)
+    return out
+
+
+def _kmeans(x, k, iters=8, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), size=k, replace=len(x) < k)].copy()
+    for _ in range(iters):
+        assign = _nearest(x, centroids)
+        counts = np.bincount(assign, minlength=k)
+        nonempty = counts > 0
+        # sum each cluster with one sort + reduceat instead of a python loop over clusters
+        order = np.argsort(assign, kind="stable")
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[nonempty]
+        centroids[nonempty] = np.add.reduceat(x[order], starts, axis=0) / counts[nonempty, None]
+    return centroids
+
+
+class ReportIndex:
+    """
+    Vector index of past reports keyed by the critic's input (last-token hidden state).
+
+    Vectors are L2-normalised and kept in one contiguous float16 matrix, so dot products
+    are cosine similarities. Below `ivf_threshold` vectors a query is an exact brute-force
+    scan over a float32 copy of the matrix (one BLAS matvec, no per-query conversion);
+    above it `build_ivf()` trains an IVF coarse quantiser plus product quantiser over the
+    residuals, and queries only scan the `nprobe` closest lists using PQ lookup tables
+    before re-ranking the best `rerank` candidates exactly against the float16 rows.
+    The number of lists grows with the index (about `list_size` vectors per list), and
+    the index is retrained in the background each time it grows `rebuild_factor` times.
+    As lists fill up between rebuilds, queries probe proportionally fewer of them (down to
+    nprobe / rebuild_factor), so a query scans roughly nprobe * list_size codes whatever
+    the index size and wherever it is in the rebuild cycle.
+
+    Everything is persisted append-only next to `path`:
+      <path>.f16    raw float16 vectors, one row per report
+      <path>.jsonl  one line of metadata (verdict, author, snippet, time) per row
+      <path>.ivf.npz  trained IVF/PQ codebooks and codes (replaced atomically by build_ivf;
+                      if it is missing or unreadable the IVF is simply retrained)
+    """
+
+    def __init__(self, dim, path="similar_reports", ivf_threshold=4096, list_size=1000,
+                 max_nlist=4096, pq_m=64, nprobe=16, rerank=128, rebuild_factor=2):
+        if dim % pq_m:
+            raise ValueError(f"hidden size {dim} is not divisible by pq_m={pq_m}")
+        self.dim = dim
+        self.path = path
+        self.ivf_threshold = ivf_threshold
+        self.list_size = list_size
+        self.max_nlist = max_nlist
+        self.rebuild_factor = rebuild_factor
+        self.pq_m = pq_m
+        self.nprobe = nprobe
+        self.rerank = rerank
+
+        self._vectors = _Growable((dim,), np.float16)
+        self._exact32 = None        # float32 copy for the exact path, dropped once IVF is built
+        self.meta = []
+        self._lock = threading.Lock()
+        self.building = False
+
+        # IVF/PQ state, None until build_ivf() has run
+        self._centroids = None      # [nlist, dim] float32
+        self._codebooks = None      # [pq_m, 256, dim // pq_m] float32
+        self._list_ids = None       # per list: _Growable of row ids
+        self._list_codes = None     # per list: _Growable of [pq_m] codes as uint16 j * 256 + code
+        self._n_encoded = 0
+        self._built_n = 0           # index size the current IVF/PQ was trained at
+
+        self._load()
+        if self._centroids is None and len(self) <= self.rebuild_factor * self.ivf_threshold:
+            self._exact32 = _Growable((dim,), np.float32)
+            self._exact32.append(self._vectors.view())
+
+    def __len__(self):
+        return self._vectors.size
+
+    # ------------------------------------------------------------------ storage
+
+    def _load(self):
+        if os.path.isfile(self.path + ".f16") and os.path.isfile(self.path + ".jsonl"):
+            with open(self.path + ".jsonl", "r", encoding="utf-8") as f:
+                meta = [json.loads(line) for line in f if line.strip()]
+            vectors = np.fromfile(self.path + ".f16", dtype=np.float16).reshape(-1, self.dim)
+            # a crash between the two appends can leave one file a row ahead; trust the shorter one
+            n = min(len(meta), len(vectors))
+            self._vectors.append(vectors[:n])
+            self.meta = meta[:n]
+        if os.path.isfile(self.path + ".ivf.npz"):
+            try:
+                with np.load(self.path + ".ivf.npz") as saved:
+                    saved = {key: saved[key] for key in ("centroids", "codebooks", "assign", "codes", "n_encoded")}
+            except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+                # unreadable (e.g. written by a version without atomic saves): treat as no IVF yet
+                return
+            if saved["centroids"].shape[1] == self.dim and int(saved["n_encoded"]) <= len(self):
+                self._install_ivf(saved["centroids"], saved["codebooks"],
+                                  saved["assign"], saved["codes"])
+                self._built_n = int(saved["n_encoded"])
+
+    def add(self, hidden, verdict, author="", content=""):
+        """Store one report's hidden vector together with the moderator's verdict."""
+        vec = self._normalise(hidden).astype(np.float16)
+        entry = {"verdict": verdict, "author": author, "content": content[:200], "time": time.time()}
+        with self._lock:
+            self._vectors.append(vec[None, :])
+            if self._exact32 is not None:
+                self._exact32.append(vec[None, :])
+            self.meta.append(entry)
+            if self._centroids is not None:
+                self._encode_tail()
+        with open(self.path + ".f16", "ab") as f:
+            f.write(vec.tobytes())
+        with open(self.path + ".jsonl", "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+        return len(self) - 1
+
+    def _normalise(self, hidden):
+        vec = np.asarray(hidden, dtype=np.float32).reshape(-1)
+        return vec / max(float(np.linalg.norm(vec)), 1e-12)
+
+    # ------------------------------------------------------------------ IVF / PQ
+
+    def needs_build(self):
+        if self.building:
+            return False
+        if self._centroids is None:
+            return len(self) >= self.ivf_threshold
+        return len(self) >= self.rebuild_factor * self._built_n
+
+    def build_ivf(self):
+        """
+        Train the coarse quantiser and product quantiser on the vectors stored so far.
+        This takes seconds to minutes, so the bot runs it in an executor; adds that land
+        while it trains are encoded once the new codebooks are installed.
+        """
+        self.building = True
+        try:
+            n = len(self)
+            rng = np.random.default_rng(0)
+            data = self._vectors.view()[:n]
+            nlist = min(self.max_nlist, max(16, n // self.list_size))
+            sample_size = min(n, max(32 * nlist, 10_000))
+            sample = data[rng.choice(n, size=sample_size, replace=False)].astype(np.float32)
+            centroids = _kmeans(sample, nlist)
+
+            residuals = sample - centroids[_nearest(sample, centroids)]
+            sub = self.dim // self.pq_m
+            pq_sample = residuals[:10_000]
+            codebooks = np.stack([
+                _kmeans(pq_sample[:, j * sub:(j + 1) * sub], 256) for j in range(self.pq_m)
+            ])
+            # encode the snapshot outside the lock so searches and adds keep flowing
+            assign, codes = self._encode(data, centroids, codebooks)
+
+            with self._lock:
+                self._install_ivf(centroids, codebooks, assign, codes)
+                self._built_n = n
+                self._exact32 = None
+                saved_assign, saved_codes = self._assign.view().copy(), self._codes.view().copy()
+            # write then rename, so a crash mid-save leaves the previous file (or none) intact
+            tmp = self.path + ".ivf.npz.tmp"
+            with open(tmp, "wb") as f:
+                np.savez(f, centroids=centroids, codebooks=codebooks,
+                         assign=saved_assign, codes=saved_codes, n_encoded=len(saved_assign))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path + ".ivf.npz")
+        finally:
+            self.building = False
+
+    def _install_ivf(self, centroids, codebooks, assign, codes):
+        self._centroids = centroids.astype(np.float32)
+        self._c_norms = (self._centroids ** 2).sum(axis=1)
+        self._codebooks = codebooks.astype(np.float32)
+        self._cb_norms = (self._codebooks ** 2).sum(axis=2)                 # [pq_m, 256]
+        self._cb_t = np.ascontiguousarray(self._codebooks.transpose(0, 2, 1))  # [pq_m, sub, 256]
+        self._list_ids = [_Growable((), np.int64, capacity=64) for _ in range(len(centroids))]
+        # list codes carry their sub-quantiser offset (j * 256 + code), so one np.take over a
+        # flattened [pq_m * 256] lookup table scores a whole list
+        self._list_codes = [_Growable((self.pq_m,), np.uint16, capacity=64) for _ in range(len(centroids))]
+        self._code_offsets = np.arange(self.pq_m, dtype=np.uint16) * 256
+        # flat copies of the assignments/codes so build_ivf can persist them
+        self._assign = _Growable((), np.int64)
+        self._codes = _Growable((self.pq_m,), np.uint8)
+        self._n_encoded = 0
+        self._add_encoded(np.asarray(assign, np.int64), np.asarray(codes, np.uint8))
+        self._encode_tail()
+
+    def _encode(self, rows, centroids, codebooks, chunk=65536):
+        sub = self.dim // self.pq_m
+        assign = np.empty(len(rows), dtype=np.int64)
+        codes = np.empty((len(rows), self.pq_m), dtype=np.uint8)
+        for i in range(0, len(rows), chunk):
+            block = rows[i:i + chunk].astype(np.float32)
+            assign[i:i + chunk] = _nearest(block, centroids)
+            residuals = block - centroids[assign[i:i + chunk]]
+            for j in range(self.pq_m):
+                codes[i:i + chunk, j] = _nearest(residuals[:, j * sub:(j + 1) * sub], codebooks[j])
+        return assign, codes
+
+    def _encode_tail(self):
+        # encode every stored row that does not have PQ codes yet
+        if self._n_encoded < len(self):
+            rows = self._vectors.view()[self._n_encoded:]
+            self._add_encoded(*self._encode(rows, self._centroids, self._codebooks))
+
+    def _add_encoded(self, assign, codes):
+        start = self._n_encoded
+        self._assign.append(assign)
+        self._codes.append(codes)
+        # group rows by list with one sort rather than a scan per list
+        order = np.argsort(assign, kind="stable")
+        lists, first = np.unique(assign[order], return_index=True)
+        for lst, members in zip(lists, np.split(order, first[1:])):
+            self._list_ids[lst].append(start + members)
+            self._list_codes[lst].append(codes[members].astype(np.uint16) + self._code_offsets)
+        self._n_encoded += len(assign)
+
+    # ------------------------------------------------------------------ queries
+
+    def search(self, hidden, k=3):
+        """
+        Return up to k (similarity, metadata) pairs for the stored reports closest to
+        `hidden`, most similar first. Similarity is cosine in [-1, 1].
+        """
+        q = self._normalise(hidden)
+        with self._lock:
+            n = len(self)
+            if n == 0:
+                return []
+            if self._centroids is None:
+                ids, sims = self._search_exact(q, k)
+            else:
+                ids, sims = self._search_ivf(q, k)
+            return [(float(s), self.meta[i]) for i, s in zip(ids, sims)]
+
+    def _search_exact(self, q, k, chunk=65536):
+        if self._exact32 is not None:
+            sims = self._exact32.view() @ q
+        else:
+            # only reached if IVF lists are all empty or a large index was loaded without one
+            data = self._vectors.view()
+            sims = np.empty(len(data), dtype=np.float32)
+            for i in range(0, len(data), chunk):
+                sims[i:i + chunk] = data[i:i + chunk].astype(np.float32) @ q
+        return self._top(np.arange(len(sims)), sims, k)
+
+    def _search_ivf(self, q, k):
+        sub = self.dim // self.pq_m
+        # lists grow up to rebuild_factor times between rebuilds; probe proportionally fewer of
+        # them so a query scans about as many codes as right after a build, however big they got
+        nprobe = round(self.nprobe * self._built_n / max(self._n_encoded, 1))
+        nprobe = min(max(nprobe, -(-self.nprobe // self.rebuild_factor), 1), self.nprobe, len(self._centroids))
+        probes = np.argpartition(self._c_norms - 2.0 * (self._centroids @ q), nprobe - 1)[:nprobe]
+
+        # asymmetric distance tables for every probe with one batched matmul:
+        # tables[p, j, c] = ||r_pj - codebook[j, c]||^2 = ||r_pj||^2 - 2 r_pj . codebook[j, c] + ||codebook[j, c]||^2
+        # (||r_pj||^2 summed over j is the same for every code in a list, so it is added per list)
+        residuals = (q - self._centroids[probes]).reshape(nprobe, self.pq_m, sub).transpose(1, 0, 2)
+        tables = self._cb_norms[:, None, :] - 2.0 * np.matmul(residuals, self._cb_t)   # [pq_m, nprobe, 256]
+        tables = np.ascontiguousarray(tables.transpose(1, 0, 2)).reshape(nprobe, -1)  # [nprobe, pq_m * 256]
+        r_norms = (residuals ** 2).sum(axis=(0, 2))                                      # [nprobe]
+
+        cand_ids, cand_dist = [], []
+        for p, lst in enumerate(probes):
+            ids = self._list_ids[lst].view()
+            if not len(ids):
+                continue
+            cand_ids.append(ids)
+            cand_dist.append(np.take(tables[p], self._list_codes[lst].view()).sum(axis=1) + r_norms[p])
+        if not cand_ids:
+            return self._search_exact(q, k)
+
+        cand_ids = np.concatenate(cand_ids)
+        cand_dist = np.concatenate(cand_dist)
+        if len(cand_ids) > self.rerank:
+            keep = np.argpartition(cand_dist, self.rerank - 1)[:self.rerank]
+            cand_ids = cand_ids[keep]
+        # exact re-rank of the shortlist against the float16 rows
+        sims = self._vectors.view()[cand_ids].astype(np.float32) @ q
+        return self._top(cand_ids, sims, k)
+
+    def _top(self, ids, sims, k):
+        k = min(k, len(ids))
+        best = np.argpartition(-sims, k - 1)[:k]
+        best = best[np.argsort(-sims[best])]
+        return ids[best], sims[best]
+
+
+def format_similar(results):
+    """Format search() results as lines for the mod channel."""
+    if not results:
+        return "No similar past reports on record."
+    lines = ["Similar past reports:"]
+    for rank, (sim, meta) in enumerate(results, start=1):
+        lines.append(f"` {rank}. ` similarity {sim:.2f}, verdict **{meta['verdict']}** "
+                     f"({meta['author']}: \"{meta['content'][:80]}\")")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # latency benchmark on random vectors: python similar_reports.py [n] [dim]
+    import sys
+    import tempfile
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    dim = int(sys.argv[2]) if len(sys.argv) > 2 else 2048
+    rng = np.random.default_rng(0)
+
+    def random_unit(count):
+        block = rng.standard_normal((count, dim), dtype=np.float32)
+        block /= np.linalg.norm(block, axis=1, keepdims=True)
+        return block.astype(np.float16)
+
+    def ms_per_query(index, queries):
+        start = time.perf_counter()
+        for q in queries:
+            index.search(q)
+        return (time.perf_counter() - start) / len(queries) * 1000
+
+    queries = rng.standard_normal((100, dim), dtype=np.float32)
+    with tempfile.TemporaryDirectory() as tmp:
+        # exact path at its worst case, just below the switch-over to IVF/PQ
+        small = ReportIndex(dim, path=os.path.join(tmp, "small"))
+        block = random_unit(small.ivf_threshold)
+        small._vectors.append(block)
+        small._exact32.append(block)
+        small.meta = [{"verdict": "minor", "author": "", "content": "", "time": 0.0}] * len(small)
+        print(f"exact, {len(small)} vectors: {ms_per_query(small, queries):.2f} ms/query")
+
+        # IVF/PQ at both ends of a rebuild cycle: right after training at n / rebuild_factor
+        # vectors, and at n - 1 vectors just before the next rebuild, when lists are largest
+        index = ReportIndex(dim, path=os.path.join(tmp, "bench"))
+        index._exact32 = None
+        index._vectors = _Growable((dim,), np.float16, capacity=n)  # no doubling copies at 1M x 2048
+        built_n = n // index.rebuild_factor
+        for i in range(0, built_n, 100_000):
+            index._vectors.append(random_unit(min(100_000, built_n - i)))
+        index.meta = [{"verdict": "minor", "author": "", "content": "", "time": 0.0}] * built_n
+
+        start = time.perf_counter()
+        index.build_ivf()
+        print(f"built IVF/PQ ({len(index._centroids)} lists) in {time.perf_counter() - start:.1f} s")
+        print(f"IVF/PQ, {len(index)} vectors, just built: {ms_per_query(index, queries):.2f} ms/query")
+
+        for i in range(built_n, n - 1, 100_000):
+            index._vectors.append(random_unit(min(100_000, n - 1 - i)))
+            with index._lock:
+                index._encode_tail()
+        index.meta = [{"verdict": "minor", "author": "", "content": "", "time": 0.0}] * len(index)
+        assert not index.needs_build()
+        print(f"IVF/PQ, {len(index)} vectors, just before rebuild: {ms_per_query(index, queries):.2f} ms/query")
@@ -0,0 +1,57 @@
+# student.py
+# Small byte-level CNN distilled from the TinyLlama + Critic teacher (see distill.py).
+# Scores a message in well under a millisecond on one CPU thread.
+import torch
+import torch.nn as nn
+
+STUDENT_PATH = "student_sextortion.pt"
+MAX_BYTES = 256
+
+
+class StudentCNN(nn.Module):
+    def __init__(self, embed_dim=32, channels=96, kernel_sizes=(3, 5, 7)):
+        super().__init__()
+        # 256 byte values + 1 padding index
+        self.embed = nn.Embedding(257, embed_dim, padding_idx=0)
+        self.convs = nn.ModuleList([
+            nn.Conv1d(embed_dim, channels, k, padding=k // 2) for k in kernel_sizes
+        ])
+        self.head = nn.Sequential(
+            nn.Linear(channels * len(kernel_sizes), 64),
+            nn.ReLU(),
+            nn.Linear(64, 1)
+        )
+
+    def forward(self, byte_ids):
+        x = self.embed(byte_ids).transpose(1, 2)     # [batch, embed_dim, seq_len]
+        # padded positions are masked out of the pool so a message scores the same alone
+        # (inference) as padded into a batch with longer ones (training)
+        padding = (byte_ids == 0).unsqueeze(1)       # [batch, 1, seq_len]
+        # global max pool: "does any window of the message look like an extortion phrase"
+        # (relu >= 0, so filling padding with 0 never raises the max and an empty message pools to 0)
+        pooled = [torch.relu(conv(x)).masked_fill(padding, 0.0).amax(dim=2) for conv in self.convs]
+        return self.head(torch.cat(pooled, dim=1))   # returns shape [batch_size, 1]
+
+
+def encode(texts, max_bytes=MAX_BYTES):
+    """UTF-8 bytes of each (lower-cased) text, shifted by one so 0 can pad. Returns [batch, max_len]."""
+    encoded = [list(t.lower().encode("utf-8")[:max_bytes]) for t in texts]
+    # convs need at least as many positions as their widest kernel
+    width = max(7, max(len(e) for e in encoded))
+    ids = torch.zeros((len(texts), width), dtype=torch.long)
+    for row, e in enumerate(encoded):
+        ids[row, :len(e)] = torch.tensor(e, dtype=torch.long) + 1
+    return ids
+
+
+def load_student(path=STUDENT_PATH, device="cpu"):
+    student = StudentCNN().to(device)
+    student.load_state_dict(torch.load(path, map_location=device))
+    student.eval()
+    return student
+
+
+def predict_student(student, text: str) -> float:
+    """Student's probability in [0,1] that text is a sextortion message."""
+    with torch.no_grad():
+        return torch.sigmoid(student(encode([text])).view(-1)).item()